@@ -2,12 +2,17 @@
 # This updates the Lambda function with the code necessary to interact with the Entsoe 3rd Party API
 
 import pandas as pd
-from entsoe import EntsoePandasClient
-import datetime
 import boto3
 import json
 import numpy as np
 import requests
+import functools
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from lxml import etree
 
 # Define country codes used in the ENTSO-E API
 # UK country code is separate as it's used in all interconnector queries
@@ -20,16 +25,55 @@ country_code_non_uk_dict = {
     "Norway": "10YNO-0--------C"
 }
 
-# Initialize AWS SSM client to retrieve API key from Parameter Store
-ssm_client = boto3.client("ssm")
-api_key = ssm_client.get_parameter(Name="entsoe-api-token", WithDecryption=False)
+# ENTSO-E Transparency Platform REST endpoint and the document type for physical flows
+entsoe_api_url = "https://web-api.tp.entsoe.eu/api"
+crossborder_flows_document_type = "A11"
+# Resolution of the grid flows are stored on
+flow_interval = pd.Timedelta(minutes=15)
 
-# Initialize ENTSO-E API client with retrieved API key
-client = EntsoePandasClient(api_key=api_key["Parameter"]["Value"])
+# S3 location of the pre-built API payload served by the second Lambda,
+# publishing is skipped when no bucket is configured
+payload_bucket = os.environ.get("PAYLOAD_BUCKET")
+payload_key = "latest.json"
 
-# Initialize DynamoDB client and reference to the table storing interconnector data
-boto_client = boto3.resource("dynamodb")
-dynamo_db_table = boto_client.Table("interconnector-data")
+# Shared HTTP session so every ENTSO-E query reuses pooled keep-alive connections
+session = requests.Session()
+session.headers.update({"Accept-Encoding": "gzip"})
+
+# Clients shared by every function, created once by get_clients
+Clients = namedtuple("Clients", ["api_key", "dynamo_db", "table", "s3"])
+
+@functools.lru_cache(maxsize=1)
+def get_clients():
+    """
+    Retrieve the ENTSO-E API key and create the DynamoDB and S3 clients
+    The result is cached so warm Lambda invocations reuse the clients, while a failed
+    initialisation is retried on the next invocation instead of breaking the container
+    Returns: Clients holding the ENTSO-E API key, DynamoDB resource, DynamoDB table and S3 client
+    """
+    # Initialize AWS SSM client to retrieve API key from Parameter Store
+    ssm_client = boto3.client("ssm")
+    api_key = ssm_client.get_parameter(Name="entsoe-api-token", WithDecryption=True)
+
+    # Initialize DynamoDB client and reference to the table storing interconnector data
+    boto_client = boto3.resource("dynamodb")
+    dynamo_db_table = boto_client.Table("interconnector-data")
+
+    # Initialize S3 client used to publish the latest API payload
+    s3_client = boto3.client("s3")
+    return Clients(
+        api_key=api_key["Parameter"]["Value"],
+        dynamo_db=boto_client,
+        table=dynamo_db_table,
+        s3=s3_client,
+    )
+
+# Preload the clients during the Lambda init phase, failures are retried in lambda_handler
+if "AWS_LAMBDA_INITIALIZATION_TYPE" in os.environ:
+    try:
+        get_clients()
+    except Exception as e:
+        print(f"Client initialisation failed, retrying on invocation: {str(e)}")
 
 def test_connection():
     """
@@ -47,154 +91,300 @@ def test_connection():
 def get_date_range():
     """
     Calculate the time window for data collection
+    Both ends are snapped to 15 minute boundaries, matching the ENTSO-E data resolution,
+    so every invocation within the same 15 minutes requests an identical window
     Returns: dict with start (24 hours ago) and end (2 hours from now) timestamps
     """
-    twenty_four_hours = datetime.datetime.today() - datetime.timedelta(days=1)
-    tomorrow = datetime.datetime.today() + datetime.timedelta(hours=2)
+    now = pd.Timestamp.now(tz="UTC").floor("15min")
     return {
-        "start": pd.Timestamp(
-            twenty_four_hours.strftime("%Y-%m-%d %H:%M:%S"), tz="UTC"
-        ),
-        "end": pd.Timestamp(tomorrow.strftime("%Y-%m-%d %H:%M:%S"), tz="UTC"),
+        "start": now - pd.Timedelta(days=1),
+        "end": now + pd.Timedelta(hours=2),
     }
 
-def get_net_flow(start_end_range, country_code):
+def parse_crossborder_flows(xml_content, start_end_range):
     """
-    Retrieve and calculate net power flow between UK and specified country
+    Parse an ENTSO-E physical flow XML document onto the 15 minute grid of a date range
     Args:
+        xml_content: raw bytes of the ENTSO-E response
         start_end_range: dict containing start and end timestamps
-        country_code: ENTSO-E country code for the interconnected country
-    Returns: pandas Series of net flow values (positive = export from UK, negative = import to UK)
+    Returns: float32 NumPy array with one slot per 15 minutes from start to end,
+             NaN where no value was published
     """
+    size = (start_end_range["end"] - start_end_range["start"]) // flow_interval + 1
+    flows = np.full(size, np.nan, dtype=np.float32)
+    found_points = False
+    reason = None
+
+    # Stream the document one Period at a time with lxml's C parser
+    for _, element in etree.iterparse(BytesIO(xml_content), tag=("{*}Period", "{*}Reason")):
+        if etree.QName(element).localname == "Reason":
+            reason = element.findtext("{*}text")
+            continue
+
+        # Each point's slot is its offset, in resolution steps, from the period start
+        period_start = pd.Timestamp(element.findtext("{*}timeInterval/{*}start"))
+        offset = (period_start - start_end_range["start"]) // flow_interval
+        step = pd.Timedelta(element.findtext("{*}resolution")) // flow_interval
+        points = element.findall("{*}Point")
+        positions = np.fromiter(
+            (int(point.findtext("{*}position")) for point in points), dtype=np.int64, count=len(points)
+        )
+        quantities = np.fromiter(
+            (float(point.findtext("{*}quantity")) for point in points), dtype=np.float32, count=len(points)
+        )
+        slots = offset + (positions - 1) * step
+        # Skip points outside the requested date range
+        in_range = (slots >= 0) & (slots < size)
+        flows[slots[in_range]] = quantities[in_range]
+        found_points = found_points or len(points) > 0
+        # Free the parsed Period now that its points have been copied out
+        element.clear()
+
+    if not found_points:
+        # ENTSO-E answers with an acknowledgement document when there is no data
+        raise Exception(f"No flow data in ENTSO-E response: {reason}")
+    return flows
+
+def get_crossborder_flow(start_end_range, from_country_code, to_country_code):
+    """
+    Retrieve power flow in one direction between two countries
+    Args:
+        start_end_range: dict containing start and end timestamps
+        from_country_code: ENTSO-E country code the power flows out of
+        to_country_code: ENTSO-E country code the power flows into
+    Returns: float32 NumPy array of flow values on the 15 minute grid of the date range
+    """
+    api_key = get_clients().api_key
     try:
         # Log request details for debugging
         print(f"Making request with parameters:")
-        print(f"From: {uk_country_code} -> {country_code}")
+        print(f"From: {from_country_code} -> {to_country_code}")
         print(f"Start: {start_end_range['start']}")
         print(f"End: {start_end_range['end']}")
 
-        # Get flows out of UK to connected country
-        flows_outward_from_uk = client.query_crossborder_flows(
-            uk_country_code,
-            country_code,
-            start=start_end_range["start"],
-            end=start_end_range["end"],
-            timeout=30
-        )
-        print("Outward flow query successful")
-
-        # Get flows into UK from connected country
-        flows_inward_to_uk = client.query_crossborder_flows(
-            country_code,
-            uk_country_code,
-            start=start_end_range["start"],
-            end=start_end_range["end"],
+        response = session.get(
+            entsoe_api_url,
+            params={
+                "securityToken": api_key,
+                "documentType": crossborder_flows_document_type,
+                "in_Domain": to_country_code,
+                "out_Domain": from_country_code,
+                "periodStart": start_end_range["start"].strftime("%Y%m%d%H%M"),
+                "periodEnd": start_end_range["end"].strftime("%Y%m%d%H%M"),
+            },
             timeout=30
         )
-        print("Inward flow query successful")
-
-        # Calculate net flow (outward - inward)
-        return flows_outward_from_uk - flows_inward_to_uk
+        response.raise_for_status()
+        flows = parse_crossborder_flows(response.content, start_end_range)
+        print(f"Flow query successful: {from_country_code} -> {to_country_code}")
+        return flows
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {str(e)}")
         print(f"Response content: {e.response.content if hasattr(e, 'response') else 'No response content'}")
         raise
     except Exception as e:
-        print(f"Error getting flows for {country_code}: {str(e)}")
+        print(f"Error getting flows for {from_country_code} -> {to_country_code}: {str(e)}")
         raise
 
 def get_all_interconnector_flows(country_code_non_uk_dict):
     """
-    Retrieve flow data for all interconnectors
+    Retrieve flow data for all interconnectors over the current date range
     Args:
         country_code_non_uk_dict: dictionary of country names and their ENTSO-E codes
     Returns: pandas DataFrame containing all interconnector flows
+             (positive = export from UK, negative = import to UK)
     """
-    all_interconnector_dict = {}
     date_range = get_date_range()
     print(f"Querying data from {date_range['start']} to {date_range['end']}")
+    # Copy so callers can't modify the cached DataFrame
+    return query_interconnector_flows(
+        tuple(country_code_non_uk_dict.items()), date_range["start"], date_range["end"]
+    ).copy()
 
-    # Iterate through each country and get its interconnector data
-    for country in list(country_code_non_uk_dict.keys()):
-        print(f"Getting data for {country} ({country_code_non_uk_dict[country]})")
-        try:
-            all_interconnector_dict[country] = get_net_flow(
-                date_range, country_code_non_uk_dict[country]
-            )
-            print(f"Successfully got data for {country}")
-        except Exception as e:
-            print(f"Failed to get data for {country}: {str(e)}")
-            raise
-
-    # Combine all flows into a single DataFrame and forward fill any missing values
-    return pd.concat(all_interconnector_dict, axis=1).ffill()
-
-def convert_df_datetime_to_strftime(interconnector_flow_df):
+@functools.lru_cache(maxsize=1)
+def query_interconnector_flows(country_codes, start, end):
     """
-    Convert DataFrame datetime index to string format for database storage
+    Query ENTSO-E for the net flow of every interconnector over a time window
+    The outward and inward queries for every country are I/O bound, so they are
+    issued concurrently. The result is cached, so warm invocations within the same
+    15 minute window reuse it rather than querying the API again
     Args:
-        interconnector_flow_df: DataFrame with datetime index
-    Returns: DataFrame with formatted datetime strings
+        country_codes: tuple of (country name, ENTSO-E code) pairs
+        start: start timestamp of the window
+        end: end timestamp of the window
+    Returns: pandas DataFrame containing all interconnector flows
     """
-    new_df = interconnector_flow_df.reset_index().rename(columns={"index": "datetime"})
-    new_df["date"] = new_df["datetime"].apply(lambda x: int(x.strftime("%Y%m%d")))
-    new_df["datetime"] = new_df["datetime"].apply(
-        lambda x: int(x.strftime("%Y%m%d%H%M%S"))
+    all_interconnector_dict = {}
+    date_range = {"start": start, "end": end}
+    country_code_non_uk_dict = dict(country_codes)
+
+    with ThreadPoolExecutor(max_workers=2 * len(country_code_non_uk_dict)) as executor:
+        # Submit flows out of UK to, and into UK from, each connected country
+        outward_futures = {}
+        inward_futures = {}
+        for country, country_code in country_code_non_uk_dict.items():
+            print(f"Getting data for {country} ({country_code})")
+            outward_futures[country] = executor.submit(
+                get_crossborder_flow, date_range, uk_country_code, country_code
+            )
+            inward_futures[country] = executor.submit(
+                get_crossborder_flow, date_range, country_code, uk_country_code
+            )
+
+        # Calculate net flow (outward - inward) for each country
+        for country in outward_futures:
+            try:
+                all_interconnector_dict[country] = (
+                    outward_futures[country].result() - inward_futures[country].result()
+                )
+                print(f"Successfully got data for {country}")
+            except Exception as e:
+                print(f"Failed to get data for {country}: {str(e)}")
+                raise
+
+    # Every flow array shares the 15 minute grid of the window, so stack them
+    # into a single DataFrame without any index alignment
+    interconnector_flow_df = pd.DataFrame(
+        np.column_stack(list(all_interconnector_dict.values())),
+        index=pd.date_range(start, end, freq=flow_interval),
+        columns=list(all_interconnector_dict),
     )
-    return new_df
+    # Drop intervals no interconnector has reported yet, then forward fill any missing values
+    interconnector_flow_df.dropna(how="all", inplace=True)
+    interconnector_flow_df.ffill(inplace=True)
+    return interconnector_flow_df
 
-def convert_float_to_int(interconnector_flow_df):
+def convert_df_for_dynamo_db(interconnector_flow_df):
     """
-    Convert float values to integers and handle infinite values
+    Prepare a flow DataFrame for database storage, modifying it in place
+    Infinite and missing values become 0, flows are downcast to the narrowest integer
+    type and the datetime index is replaced with YYYYMMDDHHMMSS integers
     Args:
-        interconnector_flow_df: DataFrame with flow values
-    Returns: DataFrame with integer values
+        interconnector_flow_df: DataFrame of flow values with a datetime index
+    Returns: the same DataFrame indexed by integer datetime, with an integer date column
     """
-    interconnector_flow_df = interconnector_flow_df.replace([np.inf, -np.inf], np.nan)  # replace inf and -inf with NaN
-    interconnector_flow_df = interconnector_flow_df.fillna(value=0)  # replace NaN with 0
-    return interconnector_flow_df.astype(int)
+    interconnector_flow_df.replace([np.inf, -np.inf], np.nan, inplace=True)  # replace inf and -inf with NaN
+    interconnector_flow_df.fillna(value=0, inplace=True)  # replace NaN with 0
+    # Flows are in MW so always fit a narrower integer type (int16/int32)
+    for column in interconnector_flow_df.columns:
+        interconnector_flow_df[column] = pd.to_numeric(interconnector_flow_df[column].astype(int), downcast="signed")
+
+    # Build the YYYYMMDD and YYYYMMDDHHMMSS integers from the datetime components
+    # with vectorized arithmetic rather than calling strftime on every row
+    timestamps = interconnector_flow_df.index
+    date = (
+        timestamps.year.to_numpy(dtype="int64") * 10**4
+        + timestamps.month.to_numpy() * 10**2
+        + timestamps.day.to_numpy()
+    )
+    interconnector_flow_df["date"] = date.astype("int32")
+    interconnector_flow_df.index = pd.Index(
+        date * 10**6
+        + timestamps.hour.to_numpy() * 10**4
+        + timestamps.minute.to_numpy() * 10**2
+        + timestamps.second.to_numpy(),
+        name="datetime",
+    )
+    return interconnector_flow_df
 
 def convert_df_to_json(interconnector_flow_df):
     """
-    Convert DataFrame to JSON format for DynamoDB storage
+    Convert DataFrame to JSON style records for DynamoDB storage
     Args:
         interconnector_flow_df: DataFrame to convert
-    Returns: JSON formatted data
+    Returns: list of dicts, one per row, holding native Python values
     """
-    return json.loads(interconnector_flow_df.reset_index().to_json(orient="records"))
+    # to_dict builds the records directly, avoiding a to_json + json.loads round trip
+    return interconnector_flow_df.reset_index().to_dict(orient="records")
 
-def check_if_exists(input):
+# Attempts at fetching a batch of keys before giving up on a throttled table
+max_batch_get_attempts = 8
+
+def get_existing_keys(interconnector_dict):
     """
-    Check if a record already exists in DynamoDB
+    Look up which records already exist in DynamoDB
     Args:
-        input: dict containing datetime and date keys
-    Returns: bool indicating if record exists
+        interconnector_dict: list of dicts containing datetime and date keys
+    Returns: set of (datetime, date) tuples already stored in the table
     """
-    response = dynamo_db_table.get_item(
-        Key={"datetime": input["datetime"], "date": input["date"]}
-    )
-    if "Item" in response:
-        return True
-    return False
+    clients = get_clients()
+    boto_client, dynamo_db_table = clients.dynamo_db, clients.table
+    existing_keys = set()
+    keys = [{"datetime": entry["datetime"], "date": entry["date"]} for entry in interconnector_dict]
+    # De-duplicate keys, batch_get_item rejects repeated keys in one request
+    keys = list({(key["datetime"], key["date"]): key for key in keys}.values())
 
-def put_into_dynamo_db(input):
+    # batch_get_item accepts at most 100 keys per request
+    for i in range(0, len(keys), 100):
+        request_items = {
+            dynamo_db_table.name: {
+                "Keys": keys[i:i + 100],
+                "ProjectionExpression": "#dt, #d",
+                "ExpressionAttributeNames": {"#dt": "datetime", "#d": "date"},
+            }
+        }
+        # Keep requesting until DynamoDB has processed every key
+        attempt = 0
+        while request_items:
+            if attempt == max_batch_get_attempts:
+                raise Exception(
+                    f"DynamoDB left keys unprocessed after {max_batch_get_attempts} batch_get_item attempts"
+                )
+            if attempt:
+                # Back off exponentially, capped, before retrying throttled keys
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+            response = boto_client.batch_get_item(RequestItems=request_items)
+            for item in response["Responses"].get(dynamo_db_table.name, []):
+                existing_keys.add((item["datetime"], item["date"]))
+            request_items = response.get("UnprocessedKeys")
+            attempt += 1
+    return existing_keys
+
+def update_dynamo_db(interconnector_dict):
     """
-    Insert a single record into DynamoDB if it doesn't already exist
+    Update DynamoDB with new interconnector flow records
+    Records that already exist are skipped, the rest are written with batch operations
     Args:
-        input: dict containing record to insert
+        interconnector_dict: list of dicts containing flow records
     """
-    if check_if_exists(input) == False:
-        dynamo_db_table.put_item(Item=input)
+    dynamo_db_table = get_clients().table
+    existing_keys = get_existing_keys(interconnector_dict)
+    # batch_writer groups puts into 25 item BatchWriteItem calls and retries unprocessed items
+    with dynamo_db_table.batch_writer(overwrite_by_pkeys=["datetime", "date"]) as batch:
+        for entry in interconnector_dict:
+            if (entry["datetime"], entry["date"]) not in existing_keys:
+                batch.put_item(Item=entry)
 
-def update_dynamo_db(interconnector_dict):
+def publish_latest_payload(interconnector_dict):
     """
-    Update DynamoDB with new interconnector flow records
+    Write the flow records to S3 in the shape the API serves them,
+    so the API can return the object as is instead of reading DynamoDB
     Args:
         interconnector_dict: list of dicts containing flow records
     """
-    # TODO: Could be optimized using batch operations
-    for entry in interconnector_dict:
-        put_into_dynamo_db(entry)
+    if not payload_bucket:
+        print("PAYLOAD_BUCKET not set, skipping payload publish")
+        return
+    if not interconnector_dict:
+        # Keep the previous payload rather than serving an empty list
+        print("No flow records, skipping payload publish")
+        return
+    s3_client = get_clients().s3
+    # The frontend expects epoch timestamps in place of the YYYYMMDDHHMMSS keys
+    timestamps = pd.to_datetime(
+        [str(entry["datetime"]) for entry in interconnector_dict], format="%Y%m%d%H%M%S", utc=True
+    )
+    epochs = (timestamps - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    records = [
+        {**entry, "datetime": int(epoch)} for entry, epoch in zip(interconnector_dict, epochs)
+    ]
+    s3_client.put_object(
+        Bucket=payload_bucket,
+        Key=payload_key,
+        Body=json.dumps({"Responses": {"interconnector-data": records}}),
+        ContentType="application/json",
+        CacheControl="max-age=60",
+    )
 
 def lambda_handler(event, context):
     """
@@ -205,19 +395,28 @@ def lambda_handler(event, context):
     Returns: dict containing status code and response message
     """
     try:
+        # Create the clients up front so worker threads share the cached instances
+        get_clients()
+
         # Get data for configured time range
         date_range = get_date_range()
         print(f"Testing API access for date range: {date_range['start']} to {date_range['end']}")
 
         # Retrieve and process interconnector flow data
-        interconnector_df = get_all_interconnector_flows(country_code_non_uk_dict)
-        interconnector_df = convert_float_to_int(interconnector_df)
-        interconnector_df = convert_df_datetime_to_strftime(interconnector_df)
-        interconnector_df.set_index("datetime", inplace=True)
-        
-        # Convert to JSON and update database
+        interconnector_df = convert_df_for_dynamo_db(
+            get_all_interconnector_flows(country_code_non_uk_dict)
+        )
+
+        # Convert to JSON, releasing the DataFrame before updating the database
         interconnector_dict = convert_df_to_json(interconnector_df)
+        del interconnector_df
         update_dynamo_db(interconnector_dict)
+        try:
+            publish_latest_payload(interconnector_dict)
+        except Exception as e:
+            # DynamoDB is already up to date, the API reads it instead once the
+            # previously published payload is older than its maximum age
+            print(f"Failed to publish payload: {str(e)}")
         
         return {"statusCode": 200, "body": json.dumps("Everything works!")}
     except requests.exceptions.HTTPError as e:
@@ -244,7 +443,6 @@ def lambda_handler(event, context):
 if __name__ == "__main__":
     try:
         print("Starting test run...")
-        print(f"Using API key: {api_key[:8]}...")  # Only show first 8 chars for security
         result = lambda_handler("","")
         print(f"Result: {json.dumps(result, indent=2)}")
     except Exception as e:
@@ -1,18 +1,22 @@
-# This Lambda function retrieves interconnector power flow data from DynamoDB and formats it for frontend display
+# This Lambda function retrieves interconnector power flow data and formats it for frontend display
 # Main components:
-# 1. Time handling: Converts between different time formats (datetime strings, epoch time)
-# 2. DynamoDB interaction: Fetches 24 hours of power flow data
-# 3. API Response: Returns formatted JSON with CORS headers enabled
+# 1. S3 interaction: Reads the payload pre-built by the first Lambda after each update
+# 2. Time handling: Converts between different time formats (datetime strings, epoch time)
+# 3. DynamoDB interaction: Fetches 24 hours of power flow data when no payload has been published
+# 4. API Response: Returns formatted JSON with CORS headers enabled
 
 # Key functions:
 # - hour_rounder(): Rounds time to nearest hour for consistent data points
 # - get_date_keys(): Generates 15-minute interval timestamps for last 24 hours
 # - convert_to_epoch(): Converts datetime strings to epoch time for JavaScript frontend
+# - query_date_partition(): Queries one date partition for a range of datetime keys
 # - get_todays_data_from_db(): Main query function to fetch and sort DynamoDB data
-# - lambda_handler(): Entrypoint that handles the API request/response cycle
+# - get_latest_payload(): Reads the published payload, falling back to DynamoDB
+# - lambda_handler(): Entrypoint that handles the API request/response cycle,
+#   caching the response body for each 15 minute bucket on warm containers
 
 # Error handling:
-# - Custom JSON encoder for Decimal types (DynamoDB specific)
+# - Custom orjson default for Decimal types (DynamoDB specific)
 # - Try/except blocks with detailed error messages
 # - Returns appropriate HTTP status codes (200 for success, 500 for errors)
 
@@ -22,22 +26,47 @@
 # Import required libraries for time handling, AWS SDK, and data processing
 import datetime
 import boto3
+import os
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 from datetime import date
 import calendar
 import json
+import orjson
+import time
 from decimal import Decimal
+from operator import itemgetter
 
-class DecimalEncoder(json.JSONEncoder):
-   # Custom encoder to convert Decimal types to float 
+def decimal_default(obj):
+   # Converts Decimal types to int or float for orjson
    # (needed because DynamoDB uses Decimal type for numbers)
-   def default(self, obj):
-       if isinstance(obj, Decimal):
-           return float(obj)
-       return super(DecimalEncoder, self).default(obj)
+   # Whole numbers stay ints so the output matches the payload published to S3
+   if isinstance(obj, Decimal):
+       if obj == obj.to_integral_value():
+           return int(obj)
+       return float(obj)
+   raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 # Initialize DynamoDB client and reference our table
 boto_client = boto3.resource("dynamodb")
 dynamo_db_table = boto_client.Table("interconnector-data")
+# Index with date as partition key and datetime as sort key,
+# left unset when the table's own key schema is already (date, datetime)
+date_index_name = os.environ.get("DATE_INDEX_NAME")
+
+# Initialize S3 client and the location the first Lambda publishes the API payload to
+# (the role needs s3:GetObject, plus s3:ListBucket so a missing payload returns
+# NoSuchKey rather than AccessDenied; both fall back to DynamoDB)
+s3_client = boto3.client("s3")
+payload_bucket = os.environ.get("PAYLOAD_BUCKET")
+payload_key = "latest.json"
+# Payloads older than the 15 minute ingest interval plus slack are treated as stale,
+# e.g. when the first Lambda failed, and DynamoDB is read instead
+payload_max_age = datetime.timedelta(minutes=30)
+
+# Response bodies cached per 15 minute bucket, reused across warm invocations
+cache_bucket_seconds = 15 * 60
+response_body_cache = {}
 
 def hour_rounder(t):
    # Rounds a datetime to the nearest hour by removing minutes/seconds
@@ -48,68 +77,108 @@ def hour_rounder(t):
 
 def get_date_keys():
    """Gets timestamps at 15-minute intervals for the past 24 hours"""
-   date_keys = []
+   # Read the clock once so the range cannot shift while the keys are built
+   now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
    # Get current time rounded to hour
-   end_range = hour_rounder(datetime.datetime.today())
+   end_range = hour_rounder(now)
    # Calculate start time (24 hours ago)
    start_range = end_range - datetime.timedelta(hours=24)
-   
-   # Generate a timestamp every 15 minutes between start and now
-   while start_range <= datetime.datetime.today():
-       start_range += datetime.timedelta(minutes=15)
-       # Convert datetime to integer format YYYYMMDDHHMMSS
-       date_keys.append(int(start_range.strftime("%Y%m%d%H%M%S")))
-   return date_keys
+   interval = datetime.timedelta(minutes=15)
+
+   # Generate a timestamp every 15 minutes after start, up to the first one past now
+   timestamps = [
+       start_range + interval * i
+       for i in range(1, (now - start_range) // interval + 2)
+   ]
+   # Convert datetime to integer format YYYYMMDDHHMMSS
+   return [
+       t.year * 10**10 + t.month * 10**8 + t.day * 10**6
+       + t.hour * 10**4 + t.minute * 10**2 + t.second
+       for t in timestamps
+   ]
 
 def convert_to_epoch(interconnector_data):
    """Converts datetime strings to epoch timestamps for JavaScript frontend"""
    try:
        # Loop through each record in the response
-       for i in range(len(interconnector_data["Responses"]["interconnector-data"])):
-           # Convert string timestamp to datetime object
-           time_stamp = datetime.datetime.strptime(
-               str(interconnector_data["Responses"]["interconnector-data"][i]["datetime"]),
-               "%Y%m%d%H%M%S",
-           )
+       for record in interconnector_data["Responses"]["interconnector-data"]:
+           # Split the YYYYMMDDHHMMSS integer into its components arithmetically
+           # rather than formatting it as a string and parsing it with strptime
+           date_part, time_part = divmod(int(record["datetime"]), 10**6)
+           year, month_day = divmod(date_part, 10**4)
+           month, day = divmod(month_day, 10**2)
+           hour, minute_second = divmod(time_part, 10**4)
+           minute, second = divmod(minute_second, 10**2)
            # Convert datetime to epoch timestamp
-           interconnector_data["Responses"]["interconnector-data"][i][
-               "datetime"
-           ] = calendar.timegm(time_stamp.timetuple())
+           record["datetime"] = calendar.timegm((year, month, day, hour, minute, second))
        return interconnector_data
    except Exception as e:
        raise Exception(f"Error converting to epoch: {str(e)}")
 
+def query_date_partition(day, first_key, last_key):
+   """Queries every item of one date partition between two datetime keys"""
+   items = []
+   query_args = {
+       "KeyConditionExpression": Key("date").eq(day) & Key("datetime").between(first_key, last_key)
+   }
+   if date_index_name:
+       query_args["IndexName"] = date_index_name
+   # Follow pagination until the whole range has been read
+   while True:
+       response = dynamo_db_table.query(**query_args)
+       items.extend(response["Items"])
+       if "LastEvaluatedKey" not in response:
+           return items
+       query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
 def get_todays_data_from_db():
    """Fetches and sorts last 24 hours of interconnector data from DynamoDB"""
    try:
-       # Batch get items using composite key of datetime and date
-       data = boto_client.batch_get_item(
-           RequestItems={
-               "interconnector-data": {
-                   "Keys": [
-                       {"datetime": dt, "date": int(str(dt)[:8])} for dt in get_date_keys()
-                   ]
-               }
-           }
-       )
+       date_keys = get_date_keys()
+       # The 24 hour range spans at most two date partitions, so query each one
+       # for its datetime range rather than looking up every key individually.
+       # The queries run one after the other as boto3 resources are not thread-safe
+       items = []
+       for day in sorted({dt // 10**6 for dt in date_keys}):
+           items.extend(query_date_partition(day, date_keys[0], date_keys[-1]))
        # Ensure we have data and sort it chronologically
-       if "Responses" in data and "interconnector-data" in data["Responses"]:
-           data["Responses"]["interconnector-data"] = sorted(
-               data["Responses"]["interconnector-data"], key=lambda x: x["datetime"]
-           )
-           # Convert timestamps to epoch format
-           data = convert_to_epoch(data)
-           return data
-       else:
+       if not items:
            raise Exception("No data found in DynamoDB response")
+       data = {"Responses": {"interconnector-data": sorted(items, key=itemgetter("datetime"))}}
+       # Convert timestamps to epoch format
+       return convert_to_epoch(data)
    except Exception as e:
        raise Exception(f"Error fetching data from DynamoDB: {str(e)}")
 
+def get_latest_payload():
+   """Reads the API payload published to S3, building it from DynamoDB if it is missing or stale"""
+   if payload_bucket:
+       try:
+           response = s3_client.get_object(Bucket=payload_bucket, Key=payload_key)
+           age = datetime.datetime.now(datetime.timezone.utc) - response["LastModified"]
+           if age <= payload_max_age:
+               return response["Body"].read().decode()
+           response["Body"].close()
+           print(f"Published payload is {age} old, reading DynamoDB")
+       except ClientError as e:
+           # Without s3:ListBucket a missing object is reported as AccessDenied
+           if e.response["Error"]["Code"] not in ("NoSuchKey", "AccessDenied"):
+               raise
+           print(f"No published payload, reading DynamoDB: {str(e)}")
+   # Convert result to JSON, handling Decimal types
+   return orjson.dumps(get_todays_data_from_db(), default=decimal_default).decode()
+
 def lambda_handler(event, context):
    """Main Lambda entry point - handles API requests and responses"""
    try:
-       # Fetch the formatted interconnector data
-       result = get_todays_data_from_db()
+       # Data only changes every 15 minutes, so serve repeat requests from the cache
+       bucket = int(time.time()) // cache_bucket_seconds
+       if bucket not in response_body_cache:
+           # Fetch the formatted interconnector data
+           body = get_latest_payload()
+           # Keep only the current bucket, evicting older ones
+           response_body_cache.clear()
+           response_body_cache[bucket] = body
 
        # Construct API response with CORS headers
        response = {
@@ -118,8 +187,7 @@ def lambda_handler(event, context):
                "Content-Type": "application/json",
                "Access-Control-Allow-Origin": "*"  # Enable CORS for all origins
            },
-           # Convert result to JSON, handling Decimal types
-           "body": json.dumps(result, cls=DecimalEncoder)
+           "body": response_body_cache[bucket]
        }
 
        return response